@@ -0,0 +1,63 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+from .reader import Reader
+
+
+if np is not None:
+    VERTEX_STATIC = np.dtype([
+        ('coord', '<f4', (4,)),
+        ('normal', '<u4'),
+        ('tangent', '<u4'),
+        ('uv_coord', '<f4', (2,)),
+    ])
+    VERTEX_SKINNED = np.dtype([
+        ('coord', '<i2', (4,)),
+        ('normal', '<u4'),
+        ('tangent', '<u4'),
+        ('bi_normal', '<u4'),
+        ('bones', 'i1', (4,)),
+        ('weights', 'u1', (4,)),
+        ('uv_coord', '<u2', (2,)),
+    ])
+    FACE_INDEX = np.dtype('<u2')
+    BONE = np.dtype([
+        ('orientation', '<f4', (3,)),
+        ('position', '<f4', (3,)),
+        ('bone_part', '<u2'),
+    ])
+else:
+    VERTEX_STATIC = None
+    VERTEX_SKINNED = None
+    FACE_INDEX = None
+    BONE = None
+
+
+def read_array(rd: Reader, dtype, count: int, copy: bool = False):
+    if np is None:
+        raise Exception("NumPy is required for vectorized reading")
+
+    # Without copy the array is a read-only view of the reader buffer
+    result = np.frombuffer(rd.get_bytes(dtype.itemsize * count), dtype=dtype, count=count)
+
+    return result.copy() if copy else result
+
+
+def read_faces(rd: Reader, count: int, copy: bool = False):
+    return read_array(rd, FACE_INDEX, count * 3, copy).reshape(count, 3)
+
+
+def unique_face_array(faces):
+    # Canonical key is the sorted vertex triple packed into 48 bits, so windings of one triangle match
+    if len(faces) == 0:
+        return faces
+
+    key = np.sort(faces, axis=1).astype(np.uint64)
+    key = (key[:, 0] << np.uint64(32)) | (key[:, 1] << np.uint64(16)) | key[:, 2]
+
+    first = np.unique(key, return_index=True)[1]
+    first.sort()
+
+    return faces[first]
@@ -0,0 +1,389 @@
+import os
+import sys
+import time
+import string
+import struct
+import tempfile
+import tracemalloc
+
+from .config import *
+from .reader import Reader
+from .match import UVec3S16
+from .model import Poly, VertexSkinned, HierarchyModel, unique_faces, flatten
+from .chunk import ChunkData
+from .arrays import np, read_array, read_faces, VERTEX_SKINNED
+from .model_transform import ModelTransformToBlender, transform_vertices
+from .skeleton import Skeleton, CHUNK_VERSION, CHUNK_BONES, CHUNK_LOCATORS, CHUNK_BONE_PARTS, CHUNK_ANIM_PATH
+from .texture_tool import DDSUtils
+
+
+# Run from the repository root:
+#   python -m io_scene_4a_engine.benchmark [name ...]
+
+
+class LegacyReader(Reader):
+    # Per-byte slicing as done before the memoryview engine, kept for comparison
+    def get_bytes(self, length: int) -> bytes:
+        result = bytes([self.bytes_data[i] for i in range(self.last_length, self.last_length + length)])
+        self.last_length += length
+
+        return result
+
+    def read_struct(self, fmt: struct.Struct) -> tuple:
+        return fmt.unpack(self.get_bytes(fmt.size))
+
+    def read_string(self) -> str:
+        result = ""
+        can_read = True
+
+        while can_read:
+            char = struct.unpack('<c', self.get_bytes(1))
+            can_read = all(c in bytes(string.printable, 'ascii') for c in char)
+
+            if can_read is True:
+                result += str(char[0], 'ascii')
+
+            if ',' in result:
+                can_read = False
+
+        return result
+
+
+def pack_chunk(chunk_id: int, payload: bytes) -> bytes:
+    return struct.pack('<II', chunk_id, len(payload)) + payload
+
+
+def legacy_hierarchy_meshes(rd: Reader) -> list:
+    # Recursive read with the lists flattened after every chunk, as HierarchyModel.read did before
+    l0, l1, meshes = list(), list(), list()
+
+    for chunk_data in ChunkData.get_all_chunk_data(rd=rd):
+        if chunk_data.chunk.id == MODEL_CHUNK_CHILD:
+            child = legacy_hierarchy_meshes(chunk_data.data)
+
+            meshes.append(child[2])
+            l0.append(child[0])
+            l1.append(child[1])
+
+        if chunk_data.chunk.id == MODEL_TYPE_NORMAL:
+            meshes.append(HierarchyModel.load_meshes(rd=chunk_data.data))
+
+        l0 = list(flatten(l0))
+        l1 = list(flatten(l1))
+        meshes = list(flatten(meshes))
+
+    return [l0, l1, meshes]
+
+
+def make_vertices(count: int) -> bytes:
+    vertex = struct.Struct('<ffffIIff')
+    data = bytearray(struct.pack('<II', MODEL_VF_STATIC, count))
+
+    for i in range(count):
+        data += vertex.pack(i * 0.1, i * 0.2, i * 0.3, 1.0, 0x7F7FFF, 0xFF7F7F, (i % 64) / 64, (i % 32) / 32)
+
+    return bytes(data)
+
+
+def make_skinned_vertices(count: int) -> bytes:
+    vertex = struct.Struct('<hhhhIIIbbbbBBBBHH')
+    data = bytearray()
+
+    for i in range(count):
+        data += vertex.pack(i % 3000, -i % 3000, i % 700, 0, 0x7F7FFF, 0xFF7F7F, 0x7FFF7F,
+                            i % 4, 1, 2, 3, 128, 64, 32, 31, i % 2048, i % 1024)
+
+    return bytes(data)
+
+
+def make_faces(count: int, vertex_count: int) -> bytes:
+    face = struct.Struct('<HHH')
+    data = bytearray()
+
+    for i in range(count):
+        a = (i * 7) % vertex_count
+        data += face.pack(a, (a + 1) % vertex_count, (a + 2 + i % 5) % vertex_count)
+
+    return bytes(data)
+
+
+def make_simple_model(vertex_count: int, face_count: int) -> bytes:
+    header = struct.pack('<BBH', 7, MODEL_TYPE_NORMAL, 0) + bytes(60)
+    material = b'textures\\a\0shader\0material\0'
+    faces = struct.pack('<I', face_count * 3) + make_faces(face_count, vertex_count)
+
+    return (pack_chunk(MODEL_CHUNK_HEADER, header) + pack_chunk(MODEL_CHUNK_TEXTURE, material) +
+            pack_chunk(MODEL_CHUNK_VERTICES, make_vertices(vertex_count)) + pack_chunk(MODEL_CHUNK_INDICES, faces))
+
+
+def make_hierarchy(depth: int) -> bytes:
+    # Every level holds one mesh and the next level as its child
+    mesh = pack_chunk(MODEL_TYPE_NORMAL, make_simple_model(8, 4))
+    node = mesh
+
+    for i in range(depth - 1):
+        node = mesh + pack_chunk(MODEL_CHUNK_CHILD, node)
+
+    header = struct.pack('<BBH', 7, MODEL_TYPE_HIERARCHY, 0) + bytes(60)
+
+    return pack_chunk(MODEL_CHUNK_HEADER, header) + node
+
+
+def legacy_resolve_parents(skeleton: Skeleton):
+    # Linear name search per bone and locator, as Skeleton.get_bone_id did before
+    for item in skeleton.bones + skeleton.locators:
+        item.parent_id = next((i for i in range(skeleton.count_bones) if skeleton.bones[i].name == item.parent_name), 0)
+
+
+def legacy_world_transforms(arrays) -> list:
+    # One matrix product per bone, parents first by recursion, for comparison
+    local = arrays.get_local_transforms()
+    world = [None] * len(local)
+
+    def get_world(i: int):
+        if world[i] is None:
+            parent = arrays.parents[i]
+            world[i] = local[i] if parent < 0 else get_world(parent) @ local[i]
+
+        return world[i]
+
+    for i in range(len(local)):
+        get_world(i)
+
+    return world
+
+
+def make_skeleton(bone_count: int, part_count: int = 4) -> bytes:
+    bone = struct.Struct('<6fH')
+    bones = bytearray(struct.pack('<IH', 0, bone_count))
+    locators = bytearray(struct.pack('<H', bone_count // 8))
+    parts = bytearray(struct.pack('<H', part_count))
+
+    for i in range(bone_count):
+        parent = f"bone_{(i - 1) // 2}" if i else ""  # binary tree
+        bones += f"bone_{i}\0{parent}\0".encode('ascii') + bone.pack(0.1, 0.2, 0.3, 0.0, 0.1, 0.0, i % part_count)
+
+    for i in range(part_count):
+        parts += f"part_{i}\0".encode('ascii') + bytes((j * (i + 1)) % 256 for j in range(bone_count))
+
+    for i in range(bone_count // 8):
+        locators += f"locator_{i}\0bone_{i * 8}\0".encode('ascii') + bytes(24)
+
+    return (pack_chunk(CHUNK_VERSION, struct.pack('<I', 1)) + pack_chunk(CHUNK_BONES, bytes(bones)) +
+            pack_chunk(CHUNK_LOCATORS, bytes(locators)) + pack_chunk(CHUNK_BONE_PARTS, bytes(parts)) +
+            pack_chunk(CHUNK_ANIM_PATH, b'animations\\rig\0'))
+
+
+def read_skeleton(data: bytes, vectorized: bool = False) -> Skeleton:
+    skeleton = Skeleton()
+    skeleton.rd = Reader(data, "")
+    skeleton.read2033(vectorized=vectorized)
+
+    return skeleton
+
+
+def make_strings(count: int) -> bytes:
+    # Material and bone name sized strings, some of them comma separated like the mesh lists
+    names = [f"textures\\level\\wall_{i % 300:04d}\0" if i % 4 else f"bone_{i}," for i in range(count)]
+    return ''.join(names).encode('ascii')
+
+
+def measure_memory(func) -> int:
+    tracemalloc.start()
+    result = func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    del result
+    return peak
+
+
+def measure(func, repeat: int = 3) -> float:
+    best = float('inf')
+
+    for i in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    return best
+
+
+def report(name: str, seconds: float, size: int):
+    print(f"{name:<40} {seconds * 1000.0:10.2f} ms {size / seconds / 1024 / 1024:10.2f} MB/s")
+
+
+def bench_reader():
+    data = make_vertices(20000)
+
+    legacy = measure(lambda: Poly.read(rd=LegacyReader(data, "")))
+    current = measure(lambda: Poly.read(rd=Reader(data, "")))
+
+    report("reader: per-byte get_bytes", legacy, len(data))
+    report("reader: memoryview + unpack_from", current, len(data))
+
+
+def bench_vertices():
+    data = make_vertices(100000)
+
+    objects = measure(lambda: Poly.read(rd=Reader(data, "")))
+    report("vertices: VertexOne objects", objects, len(data))
+
+    if np is not None:
+        arrays = measure(lambda: Poly.read(rd=Reader(data, ""), vectorized=True))
+        report("vertices: structured array", arrays, len(data))
+
+
+def bench_skinned_vertices():
+    count = 100000
+    data = make_skinned_vertices(count)
+
+    def read_objects():
+        rd = Reader(data, "")
+        return [VertexSkinned.read(rd=rd) for i in range(count)]
+
+    objects = measure(read_objects)
+    report("skinned vertices: VertexSkinned objects", objects, len(data))
+    print(f"{'':<40} {measure_memory(read_objects) / 1024 / 1024:10.2f} MB peak")
+
+    if np is not None:
+        def read_arrays():
+            return read_array(Reader(data, ""), VERTEX_SKINNED, count, copy=True)
+
+        arrays = measure(read_arrays)
+        report("skinned vertices: structured array", arrays, len(data))
+        print(f"{'':<40} {measure_memory(read_arrays) / 1024 / 1024:10.2f} MB peak")
+
+
+def bench_unique_faces():
+    count = 200000
+    data = make_faces(count, 65535)
+
+    faces = [UVec3S16.read(rd=Reader(data, "")) for i in range(count)]
+
+    report("unique faces: set() of objects", measure(lambda: list(set(faces))), len(data))
+    report("unique faces: ordered dict", measure(lambda: unique_faces(faces)), len(data))
+
+    if np is not None:
+        face_array = read_faces(Reader(data, ""), count)
+        report("unique faces: vectorized", measure(lambda: unique_faces(face_array)), len(data))
+
+
+def bench_transform():
+    count = 100000
+    data = make_skinned_vertices(count)
+
+    rd = Reader(data, "")
+    objects = [VertexSkinned.read(rd=rd) for i in range(count)]
+
+    transform = ModelTransformToBlender.__new__(ModelTransformToBlender)
+
+    report("transform: per-vertex loop", measure(lambda: transform.transform_objects(objects, [], True)), len(data))
+
+    if np is not None:
+        vertex = read_array(Reader(data, ""), VERTEX_SKINNED, count)
+        report("transform: vectorized", measure(lambda: transform_vertices(vertex, True)), len(data))
+
+
+def bench_dds():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        texture_path = os.path.join(temp_dir, 'texture.2048')
+
+        with open(texture_path, 'wb') as texture:
+            texture.write(os.urandom(2048 * 2048))  # DXT5 without mip maps
+
+        def file_round_trip():
+            with open(DDSUtils.convert_texture(texture_path), 'rb') as dds_image:
+                return dds_image.read()
+
+        size = os.path.getsize(texture_path) + 128
+
+        report("dds: convert + read .dds file", measure(file_round_trip), size)
+        report("dds: in-memory wrap", measure(lambda: DDSUtils.wrap_texture(texture_path)), size)
+        report("dds: in-memory wrap + get_bytes", measure(lambda: DDSUtils.wrap_texture(texture_path).get_bytes()), size)
+
+
+def bench_dds_header():
+    count = 10000
+
+    def build():
+        for i in range(count):
+            DDSUtils.make_header(1024, 1024, "DXT1", 0).get_bytes()
+
+    def template():
+        for i in range(count):
+            DDSUtils.get_header_bytes(1024, 524288)
+
+    report("dds header: build and pack", measure(build), count * 128)
+    report("dds header: cached template", measure(template), count * 128)
+
+
+def bench_hierarchy():
+    for depth in (50, 300):
+        data = make_hierarchy(depth)
+
+        report(f"hierarchy {depth}: recursive + flatten", measure(lambda: legacy_hierarchy_meshes(Reader(data, ""))),
+               len(data))
+        report(f"hierarchy {depth}: stack walker", measure(lambda: list(HierarchyModel.walk(Reader(data, "")))),
+               len(data))
+
+
+def bench_strings():
+    count = 20000
+    data = make_strings(count)
+
+    def read_strings(rd: Reader):
+        return [rd.read_string() for i in range(count)]
+
+    report("strings: per-byte read_string", measure(lambda: read_strings(LegacyReader(data, ""))), len(data))
+    report("strings: translate + find", measure(lambda: read_strings(Reader(data, ""))), len(data))
+
+
+def bench_skeleton():
+    for bone_count in (256, 1024):
+        data = make_skeleton(bone_count)
+        skeleton = read_skeleton(data)
+
+        report(f"skeleton {bone_count}: linear parent search", measure(lambda: legacy_resolve_parents(skeleton)),
+               len(data))
+        report(f"skeleton {bone_count}: name index", measure(skeleton.resolve_parents), len(data))
+        report(f"skeleton {bone_count}: full read", measure(lambda: read_skeleton(data)), len(data))
+
+        if np is not None:
+            report(f"skeleton {bone_count}: full read, arrays", measure(lambda: read_skeleton(data, True)), len(data))
+
+
+def bench_world_transforms():
+    if np is None:
+        return
+
+    for bone_count in (256, 1024, 4096):
+        arrays = read_skeleton(make_skeleton(bone_count), True).arrays
+        size = bone_count * 64
+
+        report(f"world transforms {bone_count}: per bone", measure(lambda: legacy_world_transforms(arrays)), size)
+        report(f"world transforms {bone_count}: per level", measure(arrays.get_world_transforms), size)
+
+
+BENCHMARKS = {
+    'reader': bench_reader,
+    'vertices': bench_vertices,
+    'skinned_vertices': bench_skinned_vertices,
+    'unique_faces': bench_unique_faces,
+    'transform': bench_transform,
+    'dds': bench_dds,
+    'dds_header': bench_dds_header,
+    'hierarchy': bench_hierarchy,
+    'strings': bench_strings,
+    'skeleton': bench_skeleton,
+    'world_transforms': bench_world_transforms,
+}
+
+
+def main(names):
+    for name in names or BENCHMARKS:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
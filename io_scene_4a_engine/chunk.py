@@ -1,21 +1,24 @@
 import struct
 
-from typing import List
+from typing import List, Optional, Iterable
 from dataclasses import dataclass, field
 
 from .reader import Reader
 
 
+CHUNK = struct.Struct('<II')
+
+
 @dataclass
 class Chunk:
     id: int = 0
     size: int = 0
+    offset: int = 0
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(8)
-        b_id, b_size = struct.unpack('<II', data)
-        return Chunk(b_id, b_size)
+        b_id, b_size = rd.read_struct(CHUNK)
+        return Chunk(b_id, b_size, rd.last_length)
 
     @staticmethod
     def check(rd: Reader, id_to_check: List[int]) -> bool:
@@ -42,15 +45,43 @@ class ChunkData:
 
     @staticmethod
     def get_all_chunk_data(rd: Reader):
-        parts = list()
+        return list(ChunkIndex(rd=rd))
+
+
+class ChunkIndex:
+    rd: Reader
+    chunks: List[Chunk]
+
+    def __init__(self, rd: Reader):
+        self.rd = rd
+        self.chunks = list()
 
+        # Only chunk headers are read here, payloads are skipped by size
         while rd.can_read():
-            chunk_part = Chunk.read(rd=rd)
-            data_part = rd.get_bytes_range(chunk_part.size)
+            chunk = Chunk.read(rd=rd)
+            rd.get_bytes(chunk.size)
+
+            self.chunks.append(chunk)
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield ChunkData(chunk, self.get_reader(chunk))
+
+    def without(self, chunk_ids: Iterable[int]):
+        # Chunks left out never get a reader, so their payload is not touched at all
+        for chunk in self.chunks:
+            if chunk.id not in chunk_ids:
+                yield ChunkData(chunk, self.get_reader(chunk))
+
+    def __len__(self):
+        return len(self.chunks)
 
-            reader_part = Reader(data_part, rd.full_path)
-            chunk_data = ChunkData(chunk_part, reader_part)
+    def get_reader(self, chunk: Chunk) -> Reader:
+        return Reader(self.rd.bytes_data[chunk.offset:chunk.offset + chunk.size], self.rd.full_path, self.rd.strings)
 
-            parts.append(chunk_data)
+    def find(self, chunk_id: int) -> Optional[ChunkData]:
+        for chunk in self.chunks:
+            if chunk.id == chunk_id:
+                return ChunkData(chunk, self.get_reader(chunk))
 
-        return parts
+        return None
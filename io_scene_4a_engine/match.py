@@ -2,6 +2,19 @@ import struct
 from .reader import Reader
 
 
+F32 = struct.Struct('<f')
+FVEC2 = struct.Struct('<ff')
+FVEC3 = struct.Struct('<fff')
+FVEC4 = struct.Struct('<ffff')
+UVEC2 = struct.Struct('<II')
+UVEC3 = struct.Struct('<III')
+UVEC4 = struct.Struct('<IIII')
+UVEC2S16 = struct.Struct('<HH')
+UVEC3S16 = struct.Struct('<HHH')
+UVEC4S16 = struct.Struct('<HHHH')
+VEC4S16 = struct.Struct('<hhhh')
+
+
 class FVec3:
     X: float = 0
     Y: float = 0
@@ -14,8 +27,7 @@ class FVec3:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(12)
-        x, y, z = struct.unpack('<fff', data)
+        x, y, z = rd.read_struct(FVEC3)
 
         return FVec3(x, y, z)
 
@@ -32,8 +44,7 @@ class UVec3:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(12)
-        x, y, z = struct.unpack('<III', data)
+        x, y, z = rd.read_struct(UVEC3)
 
         return UVec3(x, y, z)
 
@@ -50,8 +61,7 @@ class UVec3S16:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(6)
-        x, y, z = struct.unpack('<HHH', data)
+        x, y, z = rd.read_struct(UVEC3S16)
 
         return UVec3S16(x, y, z)
 
@@ -70,8 +80,7 @@ class UVec4:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(16)
-        x, y, z, w = struct.unpack('<IIII', data)
+        x, y, z, w = rd.read_struct(UVEC4)
 
         return UVec4(x, y, z, w)
 
@@ -96,8 +105,7 @@ class FVec4:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(16)
-        x, y, z, w = struct.unpack('<ffff', data)
+        x, y, z, w = rd.read_struct(FVEC4)
 
         return UVec4(x, y, z, w)
 
@@ -122,8 +130,7 @@ class UVec4S16:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(8)
-        x, y, z, w = struct.unpack('<HHHH', data)
+        x, y, z, w = rd.read_struct(UVEC4S16)
 
         return UVec4S16(x, y, z, w)
 
@@ -148,8 +155,7 @@ class Vec4S16:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(8)
-        x, y, z, w = struct.unpack('<hhhh', data)
+        x, y, z, w = rd.read_struct(VEC4S16)
 
         return UVec4S16(x, y, z, w)
 
@@ -164,8 +170,7 @@ class FVec2:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(8)
-        x, y = struct.unpack('<ff', data)
+        x, y = rd.read_struct(FVEC2)
 
         return FVec2(x, y)
 
@@ -180,8 +185,7 @@ class UVec2:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(8)
-        x, y = struct.unpack('<II', data)
+        x, y = rd.read_struct(UVEC2)
 
         return UVec2(x, y)
 
@@ -196,8 +200,7 @@ class UVec2S16:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(4)
-        x, y = struct.unpack('<HH', data)
+        x, y = rd.read_struct(UVEC2S16)
 
         return UVec2S16(x, y)
 
@@ -225,7 +228,6 @@ class BSphere:
 
     @staticmethod
     def read(rd: Reader):
-        rad_bytes: bytes = rd.get_bytes(4)
-        rad = struct.unpack('<f', rad_bytes)[0]
+        rad = rd.read_struct(F32)[0]
 
         return BSphere(FVec3.read(rd=rd), rad)
@@ -1,13 +1,24 @@
+import os
+
 from .config import *
 from .match import *
 
+from collections import OrderedDict
 from typing import List, Iterable
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from os.path import exists
 
-from .reader import Reader
+from .reader import Reader, StringPool
+from .arrays import read_array, read_faces, unique_face_array, VERTEX_STATIC, VERTEX_SKINNED
 from .skeleton import Skeleton
-from .chunk import Chunk, ChunkData
+from .chunk import Chunk, ChunkData, ChunkIndex
+
+
+HEADER = struct.Struct('<BBH')
+HEADER_RESERVED = struct.Struct('<IIIII')
+SKIN_INFLUENCE = struct.Struct('<bbbbBBBB')
+
+HIERARCHY_LODS = {MODEL_CHUNK_LOD0: 0, MODEL_CHUNK_LOD1: 1}
 
 
 @dataclass
@@ -19,8 +30,7 @@ class CheckSum:
         if Chunk.check(rd=rd, id_to_check=MODEL_CHUNK_SKELETON_CRC) is False:
             raise Exception("It's not crc32 chunk...")
 
-        data = rd.get_bytes(4)
-        check_sum = struct.unpack('<I', data)[0]
+        check_sum = rd.read_long_word()
 
         return CheckSum(check_sum)
 
@@ -36,11 +46,9 @@ class Header:
 
     @staticmethod
     def read(rd: Reader):
-        data: bytes = rd.get_bytes(4)
-
-        ver, t, material_id = struct.unpack('<BBH', data)
+        ver, t, material_id = rd.read_struct(HEADER)
         bb, bs = BBox.read(rd=rd), BSphere.read(rd=rd)
-        r = struct.unpack('<IIIII', rd.get_bytes(20))
+        r = rd.read_struct(HEADER_RESERVED)
 
         return Header(ver, t, material_id, bb, bs, list(r))
 
@@ -93,13 +101,17 @@ class VertexOne:
 class Poly:
     vertex_format: int
     vertex_count: int
-    vertex: List[VertexOne]
+    vertex: List[VertexOne]  # VERTEX_STATIC array when read vectorized
 
     @staticmethod
-    def read(rd: Reader):
+    def read(rd: Reader, vectorized: bool = False):
         vert_format = rd.read_long_word()
         count = rd.read_long_word()
-        vert = [VertexOne.read(rd=rd) for i in range(count)]
+
+        if vectorized:
+            vert = read_array(rd, VERTEX_STATIC, count)
+        else:
+            vert = [VertexOne.read(rd=rd) for i in range(count)]
 
         return Poly(vert_format, count, vert)
 
@@ -107,10 +119,10 @@ class Poly:
 @dataclass
 class Indies:
     count: int
-    faces: List[UVec3S16]
+    faces: List[UVec3S16]  # (count, 3) uint16 array when read vectorized
 
     @staticmethod
-    def read(rd: Reader, header: Header):
+    def read(rd: Reader, header: Header, vectorized: bool = False):
         if header.version < MODEL_VER_ARCTIC:
             count = rd.read_long_word()
             count_faces = int(count / 3)
@@ -118,7 +130,10 @@ class Indies:
             count_faces = rd.read_long_word()
             rd.read_word()  # shadow?
 
-        faces = [UVec3S16.read(rd=rd) for i in range(count_faces)]
+        if vectorized:
+            faces = read_faces(rd, count_faces)
+        else:
+            faces = [UVec3S16.read(rd=rd) for i in range(count_faces)]
 
         return Indies(count_faces, faces)
 
@@ -131,22 +146,22 @@ class SimpleModel:
     faces: Indies
 
     @staticmethod
-    def read(rd: Reader):
-        rd.cursor_to_start()
-
-        chunks_dates = ChunkData.get_all_chunk_data(rd=rd)
+    def read(rd: Reader, chunks: ChunkIndex = None, vectorized: bool = False):
+        if chunks is None:
+            rd.cursor_to_start()
+            chunks = ChunkIndex(rd=rd)
 
         h, m, v, f = (None, None, None, None)
 
-        for chunk_data in chunks_dates:
+        for chunk_data in chunks:
             if chunk_data.chunk.id == MODEL_CHUNK_HEADER:
                 h = Header.read(rd=chunk_data.data)
             if chunk_data.chunk.id == MODEL_CHUNK_TEXTURE:
                 m = MaterialModel.read(rd=chunk_data.data, header=h)
             if chunk_data.chunk.id == MODEL_CHUNK_VERTICES:
-                v = Poly.read(rd=chunk_data.data)
+                v = Poly.read(rd=chunk_data.data, vectorized=vectorized)
             if chunk_data.chunk.id == MODEL_CHUNK_INDICES:
-                f = Indies.read(rd=chunk_data.data, header=h)
+                f = Indies.read(rd=chunk_data.data, header=h, vectorized=vectorized)
 
         return SimpleModel(h, m, v, f)
 
@@ -160,62 +175,76 @@ class HierarchyModel:
     meshes: List[SimpleModel]
 
     @staticmethod
-    def read(rd: Reader):
-        h = None
+    def read(rd: Reader, chunks: ChunkIndex = None, vectorized: bool = False, lods: List[int] = None):
+        if chunks is None:
+            rd.cursor_to_start()
+            chunks = ChunkIndex(rd=rd)
+
+        header_data = chunks.find(MODEL_CHUNK_HEADER)
+        h = Header.read(rd=header_data.data) if header_data is not None else None
 
         l0 = list()
         l1 = list()
         meshes = list()
 
-        rd.cursor_to_start()
+        targets = {None: meshes, 0: l0, 1: l1}
 
-        chunks_dates = ChunkData.get_all_chunk_data(rd=rd)
+        for lod, path, model in HierarchyModel.walk(rd, chunks=chunks, vectorized=vectorized, lods=lods):
+            targets[lod].append(model)
 
-        for chunk_data in chunks_dates:
-            if chunk_data.chunk.id == MODEL_CHUNK_HEADER:
-                h = Header.read(rd=chunk_data.data)
+        return HierarchyModel(h, l0, l1, meshes)
 
-            if chunk_data.chunk.id == MODEL_CHUNK_CHILD:
-                h_model = HierarchyModel.read(rd=chunk_data.data)
+    @staticmethod
+    def walk(rd: Reader, chunks: ChunkIndex = None, vectorized: bool = False, lods: List[int] = None):
+        # Yields (lod, path, model) in file order, lod is None outside of LOD chunks and path holds
+        # the chunk positions down to the model. Explicit stack, so nesting depth costs nothing extra
+        if chunks is None:
+            rd.cursor_to_start()
+            chunks = ChunkIndex(rd=rd)
 
-                if len(h_model.meshes) > 0:
-                    meshes.append(h_model.meshes)
-                if len(h_model.lod0) > 0:
-                    l0.append(h_model.lod0)
-                if len(h_model.lod1) > 0:
-                    l1.append(h_model.lod1)
+        skipped = list()
 
-            if chunk_data.chunk.id == MODEL_TYPE_NORMAL:
-                meshes.append(HierarchyModel.load_meshes(rd=chunk_data.data))
+        if lods is not None:
+            skipped = [chunk_id for chunk_id, lod in HIERARCHY_LODS.items() if lod not in lods]
 
-            if chunk_data.chunk.id == MODEL_CHUNK_LOD0:
-                h_model = HierarchyModel.read(rd=chunk_data.data)
+        stack = [(iter(enumerate(chunks.chunks)), chunks, (), None)]
 
-                if len(h_model.meshes) > 0:
-                    l0.append(h_model.meshes)
-                if len(h_model.lod0) > 0:
-                    l0.append(h_model.lod0)
+        while len(stack) > 0:
+            items, index, path, lod = stack[-1]
+            item = next(items, None)
 
-            if chunk_data.chunk.id == MODEL_CHUNK_LOD1:
-                h_model = HierarchyModel.read(rd=chunk_data.data)
+            if item is None:
+                stack.pop()
+                continue
 
-                if len(h_model.meshes) > 0:
-                    l1.append(h_model.meshes)
-                if len(h_model.lod1) > 0:
-                    l1.append(h_model.lod1)
+            i, chunk = item
 
-            l0 = list(flatten(l0))
-            l1 = list(flatten(l1))
-            meshes = list(flatten(meshes))
+            if chunk.id in skipped:
+                continue
 
-        return HierarchyModel(h, l0, l1, meshes)
+            if chunk.id == MODEL_TYPE_NORMAL:
+                meshes_data = index.get_reader(chunk)
+                j = 0
+
+                while meshes_data.can_read():
+                    yield lod, path + (i, j), SimpleModel.read(rd=meshes_data, vectorized=vectorized)
+                    j += 1
+            elif chunk.id == MODEL_CHUNK_CHILD or chunk.id in HIERARCHY_LODS:
+                child_lod = HIERARCHY_LODS.get(chunk.id, lod)
+
+                # One LOD nested in another one never makes it into the model
+                if lod is not None and child_lod != lod:
+                    continue
+
+                child = ChunkIndex(rd=index.get_reader(chunk))
+                stack.append((iter(enumerate(child.chunks)), child, path + (i,), child_lod))
 
     @staticmethod
-    def load_meshes(rd: Reader):
+    def load_meshes(rd: Reader, vectorized: bool = False):
         meshes = list()
 
         while rd.can_read():
-            meshes.append(SimpleModel.read(rd=rd))
+            meshes.append(SimpleModel.read(rd=rd, vectorized=vectorized))
 
         return meshes
 
@@ -254,8 +283,8 @@ class VertexSkinned:
     def read(rd: Reader):
         point = Vec4S16.read(rd=rd)
         normal, tangent, bi_normal = rd.read_long(), rd.read_long(), rd.read_long()
-        bones = list(struct.unpack('<bbbb', rd.get_bytes(4)))
-        weights = list(struct.unpack('<BBBB', rd.get_bytes(4)))
+        influence = rd.read_struct(SKIN_INFLUENCE)
+        bones, weights = list(influence[:4]), list(influence[4:])
         uv = UVec2S16.read(rd=rd)
 
         return VertexSkinned(point, uv, bones, weights, normal, bi_normal, tangent)
@@ -267,13 +296,13 @@ class SkinnedMesh:
     material: MaterialModel
     bone_id_list: List[int]
     bone_obb_list: List[BonePosition]
-    vertex: List[VertexSkinned]
-    indies: List[UVec3S16]
+    vertex: List[VertexSkinned]  # VERTEX_SKINNED array when read vectorized
+    indies: List[UVec3S16]  # (N, 3) uint16 array when read vectorized
 
     @staticmethod
-    def read(rd: Reader):
+    def read(rd: Reader, vectorized: bool = False):
         header, material, bone_id, bone_obb, vert, indies = (None, None, None, None, None, None)
-        mesh_chunks = ChunkData.get_all_chunk_data(rd=rd)
+        mesh_chunks = ChunkIndex(rd=rd)
 
         for mesh_chunk in mesh_chunks:
             if mesh_chunk.chunk.id == MODEL_CHUNK_HEADER:
@@ -291,7 +320,10 @@ class SkinnedMesh:
                 if header.version >= MODEL_VER_ARCTIC:
                     mesh_chunk.data.read_word()
 
-                vert = [VertexSkinned.read(rd=mesh_chunk.data) for i in range(vertex_length)]
+                if vectorized:
+                    vert = read_array(mesh_chunk.data, VERTEX_SKINNED, vertex_length)
+                else:
+                    vert = [VertexSkinned.read(rd=mesh_chunk.data) for i in range(vertex_length)]
             elif mesh_chunk.chunk.id == MODEL_CHUNK_INDICES:
                 indies_length = 0
                 indies_two_length = 0
@@ -302,13 +334,17 @@ class SkinnedMesh:
                 else:
                     indies_length = int(mesh_chunk.data.read_long_word() / 3)
 
-                indies = [UVec3S16.read(rd=mesh_chunk.data) for i in range(indies_length)]
-                indies_two = [UVec3S16.read(rd=mesh_chunk.data) for i in range(indies_two_length)]
+                if vectorized:
+                    # Both lists are stored back to back, so one view covers them
+                    indies = read_faces(mesh_chunk.data, indies_length + indies_two_length)
+                else:
+                    indies = [UVec3S16.read(rd=mesh_chunk.data) for i in range(indies_length)]
+                    indies_two = [UVec3S16.read(rd=mesh_chunk.data) for i in range(indies_two_length)]
 
-                indies = [indies, indies_two]
-                indies = list(flatten(indies))
+                    indies = [indies, indies_two]
+                    indies = list(flatten(indies))
 
-                indies = list(set(indies))
+                indies = unique_faces(indies)
 
         return SkinnedMesh(header, material, bone_id, bone_obb, vert, indies)
 
@@ -318,17 +354,18 @@ class SkinnedModel:
     meshes: List[SkinnedMesh]
 
     @staticmethod
-    def read(rd: Reader):
-        rd.cursor_to_start()
-
+    def read(rd: Reader, chunks: ChunkIndex = None, vectorized: bool = False):
         meshes_to_add = list()
-        chunks_dates = ChunkData.get_all_chunk_data(rd=rd)
 
-        for chunk_data in chunks_dates:
+        if chunks is None:
+            rd.cursor_to_start()
+            chunks = ChunkIndex(rd=rd)
+
+        for chunk_data in chunks:
             if chunk_data.chunk.id == MODEL_CHUNK_CHILD:
-                child_models = ChunkData.get_all_chunk_data(rd=chunk_data.data)
+                child_models = ChunkIndex(rd=chunk_data.data)
                 for child_model in child_models:
-                    meshes_to_add.append(SkinnedMesh.read(rd=child_model.data))
+                    meshes_to_add.append(SkinnedMesh.read(rd=child_model.data, vectorized=vectorized))
 
         return SkinnedModel(meshes_to_add)
 
@@ -378,23 +415,31 @@ class RigModel:
     lod1: List[SkinnedModel]
     lod2: List[SkinnedModel]
     rig: Skeleton
+    dependencies: List[str] = field(default_factory=list)  # external .mesh paths looked up, found or not
 
     @staticmethod
-    def load_meshes(rd: Reader):
+    def load_meshes(rd: Reader, vectorized: bool = False):
         meshes = list()
 
-        models_chunks = ChunkData.get_all_chunk_data(rd=rd)
+        models_chunks = ChunkIndex(rd=rd)
 
         for model_chunk in models_chunks:
-            meshes.append(SkinnedModel.read(rd=model_chunk.data))
+            meshes.append(SkinnedModel.read(rd=model_chunk.data, vectorized=vectorized))
 
         return meshes
 
     @staticmethod
-    def read(rd: Reader, header: Header):
-        rd.cursor_to_start()
+    def read(rd: Reader, header: Header, chunks: ChunkIndex = None, vectorized: bool = False,
+             mesh_cache: 'MeshCache' = None, lods: List[int] = None):
+        if chunks is None:
+            rd.cursor_to_start()
+            chunks = ChunkIndex(rd=rd)
+
+        if mesh_cache is None:
+            mesh_cache = MeshCache()
 
-        chunk_dates = ChunkData.get_all_chunk_data(rd=rd)
+        if lods is None:
+            lods = [0, 1, 2]
 
         skeleton_path = ""
         meshes_name = list()
@@ -405,22 +450,25 @@ class RigModel:
 
         rig = None
 
-        for chunk_data in chunk_dates:
+        for chunk_data in chunks:
             if chunk_data.chunk.id == MODEL_CHUNK_SKELETON_FN:
                 skeleton_path = chunk_data.data.read_string()
             elif chunk_data.chunk.id == MODEL_CHUNK_MESHES_FN:
                 limit = chunk_data.data.read_long_word()
                 meshes_name = [chunk_data.data.read_string() for i in range(limit)]
             elif chunk_data.chunk.id == MODEL_CHUNK_MESHES:
-                models_dates = ChunkData.get_all_chunk_data(rd=chunk_data.data)
+                models_dates = ChunkIndex(rd=chunk_data.data)
 
-                for model_data in models_dates:
+                # Sub chunk id is the LOD
+                for model_data in models_dates.without([lod for lod in (0, 1, 2) if lod not in lods]):
                     if model_data.chunk.id == 0:
-                        l0.append(RigModel.load_meshes(rd=model_data.data))
+                        l0.append(RigModel.load_meshes(rd=model_data.data, vectorized=vectorized))
                     elif model_data.chunk.id == 1:
-                        l1.append(RigModel.load_meshes(rd=model_data.data))
+                        l1.append(RigModel.load_meshes(rd=model_data.data, vectorized=vectorized))
                     elif model_data.chunk.id == 2:
-                        l2.append(RigModel.load_meshes(rd=model_data.data))
+                        l2.append(RigModel.load_meshes(rd=model_data.data, vectorized=vectorized))
+
+        dependencies = list()
 
         for mesh_name in meshes_name:
             if mesh_name != "":
@@ -428,43 +476,129 @@ class RigModel:
                 lod1_path = fr"{rd.get_content_path()}\meshes\{mesh_name.replace(',', '')}_lod1.mesh"
                 lod2_path = fr"{rd.get_content_path()}\meshes\{mesh_name.replace(',', '')}_lod2.mesh"
 
-                if exists(lod0_path):
-                    l0.append(load_model(lod0_path))
-                if exists(lod1_path):
-                    l1.append(load_model(lod1_path))
-                if exists(lod2_path):
-                    l2.append(load_model(lod2_path))
+                for lod, lod_path, lod_list in ((0, lod0_path, l0), (1, lod1_path, l1), (2, lod2_path, l2)):
+                    if lod not in lods:  # never opened
+                        continue
+
+                    dependencies.append(lod_path)
+                    lod_model = mesh_cache.load(lod_path, vectorized, rd.strings)
+
+                    if lod_model is not None:
+                        lod_list.append(lod_model)
 
         l0 = list(flatten(l0))
         l1 = list(flatten(l1))
         l2 = list(flatten(l2))
 
-        return RigModel(l0, l1, l2, rig)
+        return RigModel(l0, l1, l2, rig, dependencies)
+
+
+class MeshCache:
+    max_size: int
+    size: int
+    entries: OrderedDict
+    hits: int
+    misses: int
+
+    def __init__(self, max_size: int = 512 * 1024 * 1024):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()  # (resolved path, vectorized) -> (model, file state)
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_file_state(model_path: str):
+        try:
+            stat = os.stat(model_path)
+            return stat.st_size, stat.st_mtime_ns
+        except OSError:
+            return None
+
+    def load(self, model_path: str, vectorized: bool = False, strings: StringPool = None):
+        key = (os.path.normcase(os.path.realpath(model_path)), vectorized)
+        state = MeshCache.get_file_state(model_path)
+
+        entry = self.entries.get(key)
+
+        if entry is not None and entry[1] == state:
+            self.entries.move_to_end(key)
+            self.hits += 1
+
+            return entry[0]
+
+        self.misses += 1
 
+        if entry is not None:
+            self.remove(key)
 
-def load_model(model_path: str):
-    with open(model_path, 'rb+') as model_reader:
-        g_reader = Reader(model_reader.read(), model_path)
+        # Missing files are kept too, as None, so they are not searched for again
+        model = None if state is None else load_model(model_path, vectorized, self, strings=strings)
 
-    chunks_dates = ChunkData.get_all_chunk_data(rd=g_reader)
+        self.entries[key] = (model, state)
+        self.size += MeshCache.get_entry_size(state)
 
-    h = None
+        # Sized by file length, decoded arrays are views of the mapped file
+        while self.size > self.max_size and len(self.entries) > 1:
+            self.remove(next(iter(self.entries)))
 
-    for chunk_data in chunks_dates:
-        if chunk_data.chunk.id == MODEL_CHUNK_HEADER:
-            h = Header.read(rd=chunk_data.data)
+        return model
 
-    if h is None:
+    def remove(self, key):
+        model, state = self.entries.pop(key)
+        self.size -= MeshCache.get_entry_size(state)
+
+    @staticmethod
+    def get_entry_size(state) -> int:
+        return 0 if state is None else state[0]
+
+    def clear(self):
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> str:
+        return f"meshes: {len(self.entries)} cached, {self.size / 1024 / 1024:.1f} MB, " \
+               f"{self.hits} cache hits, {self.misses} loaded"
+
+
+def load_model(model_path: str, vectorized: bool = False, mesh_cache: MeshCache = None, lods: List[int] = None,
+               strings: StringPool = None):
+    # lods selects the LODs of hierarchy and rig models to read, None reads all of them
+    g_reader = Reader.from_file(model_path, strings)
+
+    # One index serves both the header lookup and the typed reader below
+    chunks = ChunkIndex(rd=g_reader)
+    header_data = chunks.find(MODEL_CHUNK_HEADER)
+
+    if header_data is None:
         raise Exception("Not found header of model")
 
+    h = Header.read(rd=header_data.data)
+
     if h.type == MODEL_TYPE_NORMAL:
-        return SimpleModel.read(rd=g_reader)
+        return SimpleModel.read(rd=g_reader, chunks=chunks, vectorized=vectorized)
     elif h.type == MODEL_TYPE_HIERARCHY:
-        return HierarchyModel.read(rd=g_reader)
+        # Hierarchies only have LOD0 and LOD1, LOD2 is served by LOD1
+        lods = None if lods is None else [min(lod, 1) for lod in lods]
+        return HierarchyModel.read(rd=g_reader, chunks=chunks, vectorized=vectorized, lods=lods)
     elif h.type == MODEL_TYPE_SKELETON or h.type == MODEL_TYPE_ANIMATED:
-        return RigModel.read(rd=g_reader, header=h)
+        return RigModel.read(rd=g_reader, header=h, chunks=chunks, vectorized=vectorized,
+                             mesh_cache=mesh_cache, lods=lods)
     elif h.type == MODEL_TYPE_SKINNED or h.type == MODEL_TYPE_SKINNED_MESH:
-        return SkinnedModel.read(rd=g_reader)
+        return SkinnedModel.read(rd=g_reader, chunks=chunks, vectorized=vectorized)
+
+
+def unique_faces(faces):
+    if not isinstance(faces, list):
+        return unique_face_array(faces)
+
+    # Keeps the first face of every vertex triple, so the file order survives
+    unique = dict()
+
+    for face in faces:
+        unique.setdefault(tuple(sorted((face.X, face.Y, face.Z))), face)
+
+    return list(unique.values())
 
 
 def flatten(list_obj):
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+
+from typing import List, Optional
+
+from . import bl_info
+from .arrays import np
+
+
+CACHE_FORMAT = 2  # bumped whenever the stored arrays change meaning
+CACHE_ARRAYS = ('points', 'uv_map', 'normals', 'faces')
+HASH_CHUNK_SIZE = 1024 * 1024
+MTIME_MARGIN_NS = 2 * 10 ** 9  # coarsest common timestamp resolution (FAT)
+
+
+def get_file_hash(path: str) -> str:
+    file_hash = hashlib.blake2b(digest_size=20)
+
+    with open(path, 'rb') as file_data:
+        for data in iter(lambda: file_data.read(HASH_CHUNK_SIZE), b''):
+            file_hash.update(data)
+
+    return file_hash.hexdigest()
+
+
+def get_file_state(path: str) -> list:
+    if not os.path.exists(path):
+        return [path, None, None, None]
+
+    stat = os.stat(path)
+    return [path, stat.st_size, stat.st_mtime_ns, get_file_hash(path)]
+
+
+def is_file_unchanged(state: list, saved_ns: int) -> bool:
+    path, size, mtime, file_hash = state
+
+    if not os.path.exists(path):
+        return size is None
+    if size is None:
+        return False
+
+    stat = os.stat(path)
+
+    if stat.st_size != size:
+        return False
+
+    # An equal mtime is trusted unless it is too close to the cache write to tell later edits apart
+    if stat.st_mtime_ns == mtime and mtime < saved_ns - MTIME_MARGIN_NS:
+        return True
+
+    return get_file_hash(path) == file_hash
+
+
+class ModelCache:
+    cache_dir: str
+
+    def __init__(self, cache_dir: str = None):
+        self.cache_dir = os.path.join(tempfile.gettempdir(), '4a_model_cache') if cache_dir is None else cache_dir
+
+    def get_cache_path(self, model_path: str, lod: int = 0) -> str:
+        key = f"{os.path.abspath(model_path)}|{lod}|{bl_info['version']}|{CACHE_FORMAT}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.npz')
+
+    def load(self, model_path: str, lod: int = 0) -> Optional[dict]:
+        cache_path = self.get_cache_path(model_path, lod)
+
+        if np is None or not os.path.exists(cache_path):
+            return None
+
+        try:
+            with np.load(cache_path, allow_pickle=False) as cache_data:
+                meta = json.loads(str(cache_data['meta']))
+
+                if meta['format'] != CACHE_FORMAT:
+                    return None
+                if not all(is_file_unchanged(state, meta['saved']) for state in meta['dependencies']):
+                    return None
+
+                result = {'material_data': meta['material_data']}
+
+                for name in CACHE_ARRAYS:
+                    result[name] = [cache_data[f'{name}_{i}'] for i in range(len(meta['material_data']))]
+
+                return result
+        except Exception as e:  # broken or foreign cache file (BadZipFile, EOFError, ...), parse again
+            print(f"Cannot read model cache {cache_path}: {e}")
+            ModelCache.remove_file(cache_path)
+            return None
+
+    def save(self, model_path: str, lod: int, dependencies: List[str], data: dict):
+        if np is None:
+            return
+
+        meta = {
+            'format': CACHE_FORMAT,
+            'saved': time.time_ns(),
+            'dependencies': [get_file_state(path) for path in [model_path] + dependencies],
+            'material_data': data['material_data'],
+        }
+
+        arrays = {'meta': np.array(json.dumps(meta))}
+
+        for name in CACHE_ARRAYS:
+            for i, array in enumerate(data[name]):
+                arrays[f'{name}_{i}'] = np.asarray(array)
+
+        cache_path = self.get_cache_path(model_path, lod)
+        temp_path = f"{cache_path}.{os.getpid()}.tmp"
+
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+            # Written aside and moved in place, so parallel imports never read a half written file
+            with open(temp_path, 'wb') as cache_file:
+                np.savez(cache_file, **arrays)
+
+            os.replace(temp_path, cache_path)
+        except OSError as e:  # the import itself does not depend on the cache
+            print(f"Cannot write model cache {cache_path}: {e}")
+            ModelCache.remove_file(temp_path)
+
+    @staticmethod
+    def remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:  # already gone or not removable, nothing more to do
+            pass
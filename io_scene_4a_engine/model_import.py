@@ -1,6 +1,11 @@
+import os
+
 import bpy, bpy_extras
 
-from .model_transform import ModelTransformToBlender
+from .reader import StringPool
+from .model_cache import ModelCache
+from .model_transform import prepare_models
+from .texture_tool import TextureCache
 
 
 class ModelImporter(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
@@ -11,16 +16,61 @@ class ModelImporter(bpy.types.Operator, bpy_extras.io_utils.ImportHelper):
     filename_ext = ".model, .mesh"
 
     filter_glob: bpy.props.StringProperty(
-        default="*.model",
+        default="*.model;*.mesh",
         options={'HIDDEN'},
         maxlen=255
     )
 
+    files: bpy.props.CollectionProperty(
+        type=bpy.types.OperatorFileListElement,
+        options={'HIDDEN', 'SKIP_SAVE'}
+    )
+
+    directory: bpy.props.StringProperty(
+        subtype='DIR_PATH',
+        options={'HIDDEN', 'SKIP_SAVE'}
+    )
+
+    pack_textures: bpy.props.BoolProperty(
+        name="Pack Textures",
+        description="Embed textures into the .blend file instead of writing .dds files next to the game content",
+        default=False
+    )
+
+    lod: bpy.props.EnumProperty(
+        name="LOD",
+        description="Level of detail to import, the best available one is taken if the model has no such LOD. "
+                    "Hierarchy models only have LOD 0 and 1, LOD 2 imports LOD 1",
+        items=[('0', "LOD 0", "Full detail"), ('1', "LOD 1", ""), ('2', "LOD 2", "")],
+        default='0'
+    )
+
+    use_cache: bpy.props.BoolProperty(
+        name="Use Cache",
+        description="Keep parsed models on disk and reuse them while the source files are unchanged",
+        default=True
+    )
+
     def execute(self, context):
-        model_path = self.filepath
+        model_paths = [os.path.join(self.directory, file.name) for file in self.files if file.name]
+
+        if len(model_paths) == 0:
+            model_paths = [self.filepath]
+
+        # Files are parsed in worker processes, only the Blender data is built here
+        textures = TextureCache()
+
+        cache = ModelCache() if self.use_cache else None
+        strings = StringPool()
+
+        models = prepare_models(model_paths, self.pack_textures, cache, lod=int(self.lod), strings=strings)
+
+        for model_importer in models:
+            model_importer.textures = textures
+            model_importer.render_model(context, self)
 
-        model_importer = ModelTransformToBlender(model_path)
-        model_importer.render_model(context, self)
+        self.report({'INFO'}, textures.stats())
+        self.report({'INFO'}, strings.stats())
 
         return {'FINISHED'}
 
@@ -1,7 +1,15 @@
+import os
+import sys
 import math
+import multiprocessing
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 from .model import *
-from .texture_tool import DDSUtils
+from .arrays import np, unique_face_array
+from .texture_tool import DDSUtils, TextureCache
+from .model_cache import ModelCache
 
 from typing import List, Iterable
 
@@ -15,6 +23,111 @@ except ImportError:
     bmesh = None
 
 
+SCALE_FACTOR = 2720.0
+UV_FACTOR = 2048.0
+
+
+def decode_normals(packed):
+    # Bytes 2, 1, 0 of the packed value are X, Y, Z mapped from [-1, 1] to [0, 255]
+    normal = np.empty((len(packed), 3), dtype=np.float32)
+    normal[:, 0] = (packed >> 16) & 0xFF
+    normal[:, 1] = (packed >> 8) & 0xFF
+    normal[:, 2] = packed & 0xFF
+
+    return normal * (2.0 / 255.0) - 1.0
+
+
+def to_blender_axes(values, is_skin=False):
+    # Skinned meshes become (-X, -Z, Y), static ones (-X, Y, Z); normals take the same swap as positions
+    if is_skin:
+        values = values[:, [0, 2, 1]]
+        values[:, :2] *= -1.0
+    else:
+        values[:, 0] *= -1.0
+
+    return values
+
+
+def transform_vertices(vertex, is_skin=False):
+    # decode -> dequantize -> axis swap -> normalize for a whole VERTEX_STATIC or VERTEX_SKINNED array
+    coord = vertex['coord'][:, :3].astype(np.float32)
+    uv = vertex['uv_coord'].astype(np.float32)
+    normal = decode_normals(vertex['normal'])
+
+    if is_skin:
+        coord /= SCALE_FACTOR
+        uv /= UV_FACTOR
+
+    coord = to_blender_axes(coord, is_skin)
+    normal = to_blender_axes(normal, is_skin)
+
+    length = np.linalg.norm(normal, axis=1, keepdims=True)
+    np.divide(normal, length, out=normal, where=length > 0)
+
+    return coord, normal, uv
+
+
+# Set in every worker process of prepare_models, so a worker reuses the .mesh files and names it already parsed
+worker_mesh_cache = None
+worker_strings = None
+
+
+def init_worker():
+    global worker_mesh_cache, worker_strings
+    worker_mesh_cache = MeshCache()
+    worker_strings = StringPool()
+
+
+def get_python_executable():
+    # Before 2.91 sys.executable inside Blender is the Blender binary, workers must be started with its Python
+    if bpy is None or bpy.app.version >= (2, 91, 0):
+        return sys.executable
+
+    return getattr(bpy.app, 'binary_path_python', None)
+
+
+def prepare_model(model_path: str, pack_textures: bool = False, cache: ModelCache = None,
+                  mesh_cache: MeshCache = None, lod: int = 0, strings: StringPool = None):
+    # Everything but the Blender calls, so it can run in a worker process without bpy
+    return ModelTransformToBlender(model_path,
+                                   pack_textures=pack_textures,
+                                   cache=cache,
+                                   mesh_cache=worker_mesh_cache if mesh_cache is None else mesh_cache,
+                                   lod=lod,
+                                   strings=worker_strings if strings is None else strings)
+
+
+def prepare_models(model_paths: List[str], pack_textures: bool = False, cache: ModelCache = None,
+                   mesh_cache: MeshCache = None, workers: int = None, lod: int = 0, strings: StringPool = None):
+    count = len(model_paths)
+    python = get_python_executable()
+
+    if count > 1 and python:
+        try:
+            # spawn, Blender itself should not be forked
+            context = multiprocessing.get_context('spawn')
+            context.set_executable(python)
+
+            with ProcessPoolExecutor(max_workers=workers,
+                                     mp_context=context,
+                                     initializer=init_worker) as pool:
+                models = list(pool.map(prepare_model, model_paths, [pack_textures] * count, [cache] * count,
+                                       [None] * count, [lod] * count))
+
+            # Worker pools end at the process boundary, names are pooled again for the whole import
+            if strings is not None:
+                for model in models:
+                    model.intern_strings(strings)
+
+            return models
+        except (OSError, BrokenProcessPool) as e:
+            print(f"Parallel import is not available, loading one by one: {e}")
+
+    mesh_cache = MeshCache() if mesh_cache is None else mesh_cache
+
+    return [prepare_model(model_path, pack_textures, cache, mesh_cache, lod, strings) for model_path in model_paths]
+
+
 class ModelTransformToBlender:
     content_path: str
     material_data: List[List[str]]
@@ -25,22 +138,74 @@ class ModelTransformToBlender:
 
     faces: List[List[tuple]]
 
-    def __init__(self, model_path: str):
-        res = load_model(model_path)
+    textures: TextureCache
+    pack_textures: bool
+
+    def __init__(self, model_path: str, textures: TextureCache = None, pack_textures: bool = False,
+                 cache: ModelCache = None, mesh_cache: MeshCache = None, lod: int = 0, strings: StringPool = None):
+        self.textures = TextureCache() if textures is None else textures
+        self.pack_textures = pack_textures
 
         self.content_path = model_path[:model_path.find("\\meshes\\")]
         self.content_path = str(self.content_path)
 
+        self.reset_model_data()
+
+        cached = cache.load(model_path, lod) if cache is not None else None
+
+        if cached is not None:
+            for name, value in cached.items():
+                setattr(self, name, value)
+
+            if strings is not None:
+                self.intern_strings(strings)
+            return
+
+        # Only the wanted LOD is read, the others are skipped in the file
+        res = load_model(model_path, vectorized=np is not None, mesh_cache=mesh_cache, lods=[lod], strings=strings)
+        self.from_model(res, lod)
+
+        if type(res) in (HierarchyModel, RigModel) and self.is_lod_missing(res, lod):
+            # The model has no such LOD, take the best one it has
+            self.reset_model_data()
+
+            res = load_model(model_path, vectorized=np is not None, mesh_cache=mesh_cache, strings=strings)
+            self.from_model(res, lod)
+
+        if cache is not None:
+            cache.save(model_path, lod, res.dependencies if type(res) is RigModel else [], {
+                'material_data': self.material_data,
+                'points': self.points,
+                'uv_map': self.uv_map,
+                'normals': self.normals,
+                'faces': self.faces,
+            })
+
+    def reset_model_data(self):
         self.material_data, self.points, self.uv_map, self.normals, self.faces = [list(),
                                                                                   list(),
                                                                                   list(),
                                                                                   list(),
                                                                                   list()]
 
+    def is_lod_missing(self, res, lod: int) -> bool:
+        # Meshes outside of LODs are read for every selection, they do not stand in for a missing LOD1
+        if type(res) is HierarchyModel and lod > 0:
+            return len(res.lod1) == 0
+
+        return len(self.points) == 0
+
+    def intern_strings(self, strings: StringPool):
+        self.material_data = [[strings.intern(name) for name in material] for material in self.material_data]
+
+    def from_model(self, res, lod: int = 0):
         if type(res) is SimpleModel:
             self.from_simple_model(res)
         elif type(res) is HierarchyModel:
-            if len(res.lod0) > 0:
+            # A lower detail request takes LOD1 when there is one, before the meshes outside of LODs
+            if lod > 0 and len(res.lod1) > 0:
+                self.from_simple_model(res.lod1)
+            elif len(res.lod0) > 0:
                 self.from_simple_model(res.lod0)
             elif len(res.meshes) > 0:
                 self.from_simple_model(res.meshes)
@@ -73,15 +238,17 @@ class ModelTransformToBlender:
             obj_col = bpy.data.collections.new("4a_hierarchy")
             context.scene.collection.children.link(obj_col)
 
+            add_mesh = self.add_mesh if np is None else self.add_mesh_bulk
+
             for i in range(mesh_count):
-                self.add_mesh("4a_mesh",
-                              self.points[i],
-                              self.faces[i],
-                              self.normals[i],
-                              self.uv_map[i],
-                              self.material_data[i],
-                              context,
-                              obj_col)
+                add_mesh("4a_mesh",
+                         self.points[i],
+                         self.faces[i],
+                         self.normals[i],
+                         self.uv_map[i],
+                         self.material_data[i],
+                         context,
+                         obj_col)
 
     def add_mesh(self, name, vertex, faces, normals, uv_map, material_data, context, col):
         mesh = bpy.data.meshes.new(name)
@@ -121,12 +288,53 @@ class ModelTransformToBlender:
         mesh.auto_smooth_angle = math.pi
         mesh.use_auto_smooth = True
 
-        mesh.normals_split_custom_set_from_vertices([
-            (
-                self.calc_normals(normals[vert.index][0]),  # X normal
-                self.calc_normals(normals[vert.index][2]),  # Z normal
-                self.calc_normals(normals[vert.index][1])   # Y normal
-             ) for vert in bm.verts])
+        mesh.normals_split_custom_set_from_vertices([normals[vert.index] for vert in bm.verts])
+
+        mesh.update()
+
+        # set material
+        self.set_material(obj, material_data[0], material_data[2])
+
+    def add_mesh_bulk(self, name, vertex, faces, normals, uv_map, material_data, context, col):
+        mesh = bpy.data.meshes.new(name)
+        obj = bpy.data.objects.new(mesh.name, mesh)
+        col.objects.link(obj)
+
+        vertex = np.asarray(vertex, dtype=np.float32).reshape(-1, 3)
+        uv_map = np.asarray(uv_map, dtype=np.float32).reshape(-1, 2)
+        normals = np.asarray(normals, dtype=np.float32).reshape(-1, 3)
+        faces = np.asarray(faces, dtype=np.int32).reshape(-1, 3)
+
+        # Drop the faces bmesh would reject: repeated, degenerate or out of range
+        faces = unique_face_array(faces)
+        faces = faces[(faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])]
+        faces = faces[(faces < len(vertex)).all(axis=1)]
+
+        loops = faces.ravel()
+
+        mesh.vertices.add(len(vertex))
+        mesh.vertices.foreach_set("co", vertex.ravel())
+
+        mesh.loops.add(len(loops))
+        mesh.loops.foreach_set("vertex_index", loops)
+
+        mesh.polygons.add(len(faces))
+        mesh.polygons.foreach_set("loop_start", np.arange(0, len(loops), 3, dtype=np.int32))
+        mesh.polygons.foreach_set("loop_total", np.full(len(faces), 3, dtype=np.int32))
+        mesh.polygons.foreach_set("use_smooth", np.ones(len(faces), dtype=bool))
+
+        loops_uv = uv_map[loops]
+        loops_uv[:, 1] = 1 - loops_uv[:, 1]
+
+        uv_layer = mesh.uv_layers.new(name='4A_UVMap')
+        uv_layer.data.foreach_set("uv", loops_uv.ravel())
+
+        mesh.update(calc_edges=True)
+
+        mesh.auto_smooth_angle = math.pi
+        mesh.use_auto_smooth = True
+
+        mesh.normals_split_custom_set_from_vertices(normals)
 
         mesh.update()
 
@@ -137,20 +345,22 @@ class ModelTransformToBlender:
         return 2.0 * normal / 255 - 1.0
 
     def set_material(self, obj, texture_path, material_type):
-        texture_path_dds = ""
         texture_path = "{0}\\textures\\{1}.512".format(self.content_path, texture_path)
 
-        if exists(texture_path):
-            texture_path_dds = DDSUtils.convert_texture(texture_path)
+        if bpy is not None and exists(texture_path):
+            try:
+                image = self.get_image(texture_path)
+            except Exception as e:  # unknown texture layout, the mesh stays without material
+                print(e)
+                return
 
-        if bpy is not None and texture_path_dds != "":
             m_material = bpy.data.materials.new("4a_material")
             m_material.use_nodes = True
 
             shader = m_material.node_tree.nodes["Principled BSDF"]
 
             m_texture = m_material.node_tree.nodes.new('ShaderNodeTexImage')
-            m_texture.image = bpy.data.images.load(texture_path_dds)
+            m_texture.image = image
 
             m_material.node_tree.links.new(shader.inputs['Base Color'], m_texture.outputs['Color'])
 
@@ -160,6 +370,25 @@ class ModelTransformToBlender:
             else:
                 obj.data.materials.append(m_material)
 
+    def get_image(self, texture_path):
+        # Submeshes and models sharing a texture share one image datablock
+        key = (texture_path, self.pack_textures)
+        image = self.textures.images.get(key)
+
+        if image is None:
+            if self.pack_textures:  # embed into the .blend, no .dds is written next to the game files
+                texture = DDSUtils.wrap_texture(texture_path)
+
+                image = bpy.data.images.new(os.path.basename(DDSUtils.get_dds_path(texture_path)), 1, 1)
+                image.pack(data=texture.get_bytes(), data_len=len(texture))
+                image.source = 'FILE'
+            else:
+                image = bpy.data.images.load(self.textures.convert_texture(texture_path), check_existing=True)
+
+            self.textures.images[key] = image
+
+        return image
+
     def from_skinned_model(self, skin_model):
         skin_meshes: List[SkinnedMesh] = list(flatten(skin_model.meshes))
 
@@ -167,7 +396,7 @@ class ModelTransformToBlender:
             self.update_model_data(skin.vertex, skin.indies, skin.material, True)
 
     def from_simple_model(self, h_models):
-        simple_models_list: List[SimpleModel] = list(flatten(h_models))
+        simple_models_list: List[SimpleModel] = list(flatten([h_models]))
 
         for simple_model in simple_models_list:
             material = simple_model.material
@@ -178,9 +407,21 @@ class ModelTransformToBlender:
             self.update_model_data(vertex, indies, material)
 
     def update_model_data(self, points, faces, material, is_skin=False):
-        scale_factor = 2720.0
-        uv_factor = 2048.0
+        if np is not None and not isinstance(points, list):
+            vertex, normal, uv = transform_vertices(points, is_skin)
+            indies = faces
+        else:
+            vertex, normal, uv, indies = self.transform_objects(points, faces, is_skin)
+
+        self.material_data.append([material.texture_name, material.shader, material.material_name])
+
+        self.normals.append(normal)
+        self.points.append(vertex)
+        self.uv_map.append(uv)
+
+        self.faces.append(indies)
 
+    def transform_objects(self, points, faces, is_skin=False):
         points = list(flatten(points))
         faces = list(flatten(faces))
 
@@ -192,13 +433,13 @@ class ModelTransformToBlender:
 
         for vert in points:
             if is_skin:
-                vertex.append((vert.coord.X / scale_factor * -1.0,
-                               vert.coord.Z / scale_factor * -1.0,
-                               vert.coord.Y / scale_factor
+                vertex.append((vert.coord.X / SCALE_FACTOR * -1.0,
+                               vert.coord.Z / SCALE_FACTOR * -1.0,
+                               vert.coord.Y / SCALE_FACTOR
                                ))
                 uv.append((
-                    vert.uv_coord.X / uv_factor,
-                    vert.uv_coord.Y / uv_factor
+                    vert.uv_coord.X / UV_FACTOR,
+                    vert.uv_coord.Y / UV_FACTOR
                 ))
             else:
                 vertex.append((vert.coord.X * -1.0, vert.coord.Y, vert.coord.Z))
@@ -207,25 +448,20 @@ class ModelTransformToBlender:
                     vert.uv_coord.Y
                 ))
 
-            normal.append((
-                ((vert.normal << 16) & 0xFF) / 255.0,
-                ((vert.normal << 8) & 0xFF) / 255.0,
-                (vert.normal & 0xFF) / 255.0
-            )
-            )
+            n_x = self.calc_normals((vert.normal >> 16) & 0xFF)
+            n_y = self.calc_normals((vert.normal >> 8) & 0xFF)
+            n_z = self.calc_normals(vert.normal & 0xFF)
+
+            # Same axis swap and signs as the position above
+            if is_skin:
+                normal.append((n_x * -1.0, n_z * -1.0, n_y))
+            else:
+                normal.append((n_x * -1.0, n_y, n_z))
 
         for face in faces:
             indies.append((face.X, face.Y, face.Z))
 
-        normal = self.normalize_normal(normal)
-
-        self.material_data.append([material.texture_name, material.shader, material.material_name])
-
-        self.normals.append(normal)
-        self.points.append(vertex)
-        self.uv_map.append(uv)
-
-        self.faces.append(indies)
+        return vertex, self.normalize_normal(normal), uv, indies
 
     def normalize_normal(self, normals: List[tuple]):
         normals2 = list()
@@ -237,4 +473,4 @@ class ModelTransformToBlender:
             else:
                 normals2.append((normal[0], normal[1], normal[2]))
 
-        return normals
+        return normals2
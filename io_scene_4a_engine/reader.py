@@ -1,65 +1,135 @@
+import sys
+import mmap
 import struct
 import string
 
 
+U8 = struct.Struct('<B')
+U16 = struct.Struct('<H')
+U32 = struct.Struct('<I')
+
+PRINTABLE = bytes(string.printable, 'ascii')
+# 1 for bytes that continue a string, 0 for the ones that end it: non-printable bytes and the comma
+STRING_TABLE = bytes(int(i in PRINTABLE and i != ord(',')) for i in range(256))
+STRING_WINDOW = 64
+
+
+class StringPool:
+    strings: dict
+    duplicates: int
+    saved: int
+
+    def __init__(self):
+        self.strings = dict()
+        self.duplicates = 0
+        self.saved = 0  # bytes of the string objects dropped in favour of a pooled one
+
+    def intern(self, value: str) -> str:
+        pooled = self.strings.setdefault(value, value)
+
+        if pooled is not value:
+            self.duplicates += 1
+            self.saved += sys.getsizeof(value)
+
+        return pooled
+
+    def clear(self):
+        self.strings.clear()
+
+    def stats(self) -> str:
+        return f"strings: {len(self.strings)} unique, {self.duplicates} duplicates shared, " \
+               f"{self.saved / 1024:.1f} KB saved"
+
+
 class Reader:
     last_length: int = 0
-    bytes_data: bytes
+    bytes_data: memoryview
     full_path: str
+    strings: StringPool
 
-    def __init__(self, bytes_data: bytes, path: str):
+    def __init__(self, bytes_data, path: str, strings: StringPool = None):
         self.full_path = path
-        self.bytes_data = bytes_data
+        self.bytes_data = memoryview(bytes_data)
+        self.strings = strings  # equal strings read through one pool are one object
+
+    @staticmethod
+    def from_file(path: str, strings: StringPool = None):
+        # Readers of nested chunks are slices of this mapping, so the file is never copied
+        with open(path, 'rb') as file_data:
+            try:
+                data = mmap.mmap(file_data.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:  # empty files cannot be mapped
+                data = b''
+
+        return Reader(data, path, strings)
 
     def cursor_to_start(self):
         self.last_length = 0
 
-    def get_bytes(self, length: int) -> bytes:
-        try:
-            result: bytes = bytes([self.bytes_data[i] for i in range(self.last_length, self.last_length + length)])
-            self.last_length += length
+    def get_bytes(self, length: int) -> memoryview:
+        end = self.last_length + length
 
-            return result
-        except:
+        if length < 0 or end > len(self.bytes_data):
             raise Exception('Cannot get bytes from file!')
 
-    def get_bytes_range(self, size: int):
-        result = bytes([self.bytes_data[i] for i in range(self.last_length, self.last_length + size)])
-        self.last_length += size
+        result = self.bytes_data[self.last_length:end]
+        self.last_length = end
+
+        return result
+
+    def get_bytes_range(self, size: int) -> memoryview:
+        return self.get_bytes(size)
+
+    def read_struct(self, fmt: struct.Struct) -> tuple:
+        try:
+            result = fmt.unpack_from(self.bytes_data, self.last_length)
+        except struct.error:
+            raise Exception('Cannot get bytes from file!')
+
+        self.last_length += fmt.size
 
         return result
 
     def read_string(self) -> str:
-        result = ""
-        can_read = True
+        # The terminator is consumed, a comma stays in the result
+        start = self.last_length
+        window = STRING_WINDOW
 
-        while can_read:
-            char = struct.unpack('<c', self.get_bytes(1))
-            can_read = Reader.is_ascii(char)
+        while True:
+            end = min(start + window, len(self.bytes_data))
+            stop = bytes(self.bytes_data[start:end]).translate(STRING_TABLE).find(0)
 
-            if can_read is True:
-                result += str(char[0], 'ascii')
+            if stop >= 0:
+                break
+            if end == len(self.bytes_data):
+                raise Exception('Cannot get bytes from file!')
 
-            if ',' in result:
-                result.replace(',', '')
-                can_read = False
+            window *= 2
 
-        return result
+        stop += start
+        self.last_length = stop + 1
+
+        if self.bytes_data[stop] == ord(','):
+            stop += 1
+
+        result = str(self.bytes_data[start:stop], 'ascii')
+
+        return result if self.strings is None else self.strings.intern(result)
 
     def get_content_path(self):
         return self.full_path[:self.full_path.find('\\meshes\\')]
 
     def read_long(self) -> int:
-        return struct.unpack("<L", self.get_bytes(4))[0]
+        return self.read_struct(U32)[0]
 
     def read_long_word(self) -> int:
-        return struct.unpack("<I", self.get_bytes(4))[0]
+        return self.read_struct(U32)[0]
 
     def read_word(self) -> int:
-        return struct.unpack("<H", self.get_bytes(2))[0]
+        return self.read_struct(U16)[0]
 
     def read_byte(self) -> int:
-        return struct.unpack("<B", self.get_bytes(1))[0]
+        return self.read_struct(U8)[0]
 
     def back_cursor(self, number_to_backup: int):
         self.last_length -= number_to_backup
@@ -69,5 +139,4 @@ class Reader:
 
     @staticmethod
     def is_ascii(s):
-        printable_chars = bytes(string.printable, 'ascii')
-        return all(char in printable_chars for char in s)
+        return all(char in PRINTABLE for char in s)
@@ -1,9 +1,10 @@
 from .match import *
 
-from typing import List, TYPE_CHECKING
+from typing import List, Dict, Tuple, Optional, TYPE_CHECKING
 from dataclasses import dataclass, field
 
-from .reader import Reader
+from .reader import Reader, StringPool
+from .arrays import np, BONE
 from .chunk import Chunk
 
 
@@ -15,6 +16,8 @@ CHUNK_BONE_PARTS = 17
 CHUNK_ANIM_PATH = 19
 CHUNK_PARAMS = 27
 
+NO_BONE = -1
+
 
 @dataclass
 class Locator:
@@ -59,22 +62,135 @@ class Bone:
 @dataclass
 class BonePart:
     name: str
-    weights: List[int]
+    weights: bytes  # one byte per bone
 
     @staticmethod
     def read2033(rd: Reader, bone_count: int):
         bone_parts: List[BonePart] = list()
         count = rd.read_word()
 
-        for i in range(bone_count):
+        # Every part is a name followed by one weight per bone
+        for i in range(count):
             name = rd.read_string()
-            weights = [rd.read_byte() for i in range(count)]
+            weights = bytes(rd.get_bytes(bone_count))
 
             bone_parts.append(BonePart(name, weights))
 
         return bone_parts
 
 
+@dataclass
+class SkeletonArrays:
+    # Bones as parallel arrays, row i of every array is bone i
+    names: List[str]
+    parent_names: List[str]
+    parents: 'np.ndarray'  # int32, NO_BONE for roots and unknown parents
+    orientations: 'np.ndarray'  # (bones, 3) float32
+    positions: 'np.ndarray'  # (bones, 3) float32
+    bone_parts: 'np.ndarray'  # uint16
+    part_names: List[str]
+    part_weights: 'np.ndarray'  # (parts, bones) uint8
+
+    @staticmethod
+    def read_bones(rd: Reader, count: int):
+        names, parent_names = list(), list()
+        records = bytearray()
+
+        # Only the names are variable sized, the rest of every bone is copied as is and decoded at once
+        for i in range(count):
+            names.append(rd.read_string())
+            parent_names.append(rd.read_string())
+            records += rd.get_bytes(BONE.itemsize)
+
+        bones = np.frombuffer(bytes(records), dtype=BONE, count=count)
+
+        return SkeletonArrays(names, parent_names, np.full(count, NO_BONE, dtype=np.int32),
+                              bones['orientation'], bones['position'], bones['bone_part'],
+                              list(), np.zeros((0, count), dtype=np.uint8))
+
+    @staticmethod
+    def from_bones(bones: List['Bone'], bones_part: List[BonePart]):
+        if np is None:
+            raise Exception("NumPy is required for skeleton arrays")
+
+        count = len(bones)
+
+        arrays = SkeletonArrays([bone.name for bone in bones],
+                                [bone.parent_name for bone in bones],
+                                np.array([bone.parent_id for bone in bones], dtype=np.int32),
+                                np.array([[b.orientation.X, b.orientation.Y, b.orientation.Z] for b in bones],
+                                         dtype=np.float32).reshape(count, 3),
+                                np.array([[b.position.X, b.position.Y, b.position.Z] for b in bones],
+                                         dtype=np.float32).reshape(count, 3),
+                                np.array([bone.bone_part for bone in bones], dtype=np.uint16),
+                                list(), None)
+        arrays.set_parts(bones_part)
+
+        return arrays
+
+    def get_local_transforms(self):
+        # Orientation is Euler angles in radians applied X, then Y, then Z, followed by the position
+        count = len(self.names)
+        cos, sin = np.cos(self.orientations.astype(np.float64)), np.sin(self.orientations.astype(np.float64))
+
+        rotations = np.zeros((3, count, 3, 3))
+
+        for axis in range(3):
+            a, b = [i for i in range(3) if i != axis]
+
+            rotations[axis, :, axis, axis] = 1.0
+            rotations[axis, :, a, a] = cos[:, axis]
+            rotations[axis, :, b, b] = cos[:, axis]
+            rotations[axis, :, a, b] = -sin[:, axis] if axis != 1 else sin[:, axis]
+            rotations[axis, :, b, a] = sin[:, axis] if axis != 1 else -sin[:, axis]
+
+        result = np.zeros((count, 4, 4))
+        result[:, :3, :3] = rotations[2] @ rotations[1] @ rotations[0]
+        result[:, :3, 3] = self.positions
+        result[:, 3, 3] = 1.0
+
+        return result
+
+    def get_levels(self) -> List['np.ndarray']:
+        # Bone indices grouped by depth, every level only depends on the one before it
+        count = len(self.names)
+        parents = self.parents
+        placed = np.zeros(count, dtype=bool)
+
+        level = np.flatnonzero((parents < 0) | (parents >= count))
+        levels = list()
+
+        while len(level) > 0:
+            placed[level] = True
+            levels.append(level)
+
+            level = np.flatnonzero(~placed & np.isin(parents, level))
+
+        if not placed.all():  # parent loops, such bones are taken as roots
+            print(f"Skeleton has {count - placed.sum()} bones in parent loops")
+            levels[0] = np.concatenate([levels[0], np.flatnonzero(~placed)]) if levels else np.flatnonzero(~placed)
+
+        return levels
+
+    def get_world_transforms(self):
+        # (bones, 4, 4) float64, one batched matrix product per hierarchy level
+        world = self.get_local_transforms()
+
+        for level in self.get_levels()[1:]:
+            world[level] = world[self.parents[level]] @ world[level]
+
+        return world
+
+    def set_parts(self, bones_part: List[BonePart]):
+        self.part_names = [part.name for part in bones_part]
+
+        if len(bones_part) == 0:
+            self.part_weights = np.zeros((0, len(self.names)), dtype=np.uint8)
+        else:
+            weights = b''.join(part.weights for part in bones_part)
+            self.part_weights = np.frombuffer(weights, dtype=np.uint8).reshape(len(bones_part), -1)
+
+
 @dataclass
 class Skeleton:
     rd: Reader = None
@@ -86,12 +202,14 @@ class Skeleton:
     locators: List[Locator] = field(default_factory=list)
     bones_part: List[BonePart] = field(default_factory=list)
     animation_path: str = ""
+    bone_ids: Dict[str, int] = field(default_factory=dict)
+    unresolved_parents: List[Tuple[str, str]] = field(default_factory=list)  # (bone or locator, missing parent)
+    arrays: Optional[SkeletonArrays] = None  # set instead of bones when read vectorized
 
-    def start(self, path: str):
-        with open(path, 'rb+') as skeleton_data:
-            self.rd = Reader(skeleton_data.read() , path)
+    def start(self, path: str, strings: StringPool = None):
+        self.rd = Reader.from_file(path, strings)
 
-    def read2033(self):
+    def read2033(self, vectorized: bool = False):
         result: bool = True
 
         if Chunk.check(rd=self.rd, id_to_check=CHUNK_VERSION):
@@ -102,7 +220,17 @@ class Skeleton:
         if Chunk.check(rd=self.rd, id_to_check=CHUNK_BONES):
             self.check_sum = self.rd.read_long_word()
             self.count_bones = self.rd.read_word()
-            self.bones = [Bone.read2033(rd=self.rd) for i in range(self.count_bones)]
+            self.bones = list()
+
+            if vectorized:
+                self.arrays = SkeletonArrays.read_bones(rd=self.rd, count=self.count_bones)
+            else:
+                self.bones = [Bone.read2033(rd=self.rd) for i in range(self.count_bones)]
+
+            names = self.arrays.names if vectorized else [bone.name for bone in self.bones]
+
+            for i, name in enumerate(names):
+                self.bone_ids.setdefault(name, i)  # the first bone wins on duplicate names
         elif result is True:
             result = False
 
@@ -115,6 +243,9 @@ class Skeleton:
 
         if Chunk.check(rd=self.rd, id_to_check=CHUNK_BONE_PARTS):
             self.bones_part = BonePart.read2033(rd=self.rd, bone_count=self.count_bones)
+
+            if self.arrays is not None:
+                self.arrays.set_parts(self.bones_part)
         elif result is True:
             result = False
 
@@ -123,17 +254,40 @@ class Skeleton:
         elif result is True:
             result = False
 
-        for bone in self.bones:
-            bone.parent_id = self.get_bone_id(bone.parent_name)
-
-        for locator in self.locators:
-            locator.parent_id = self.get_bone_id(locator.parent_name)
+        self.resolve_parents()
 
         return result
 
+    def resolve_parents(self):
+        # Roots have an empty parent name, any other name without a bone is kept as unresolved
+        self.unresolved_parents = list()
+
+        if self.arrays is not None:
+            self.arrays.parents = np.array([self.get_parent_id(name, parent_name) for name, parent_name
+                                            in zip(self.arrays.names, self.arrays.parent_names)], dtype=np.int32)
+
+        for item in self.bones + self.locators:
+            item.parent_id = self.get_parent_id(item.name, item.parent_name)
+
+        if len(self.unresolved_parents) > 0:
+            print(f"Skeleton has {len(self.unresolved_parents)} unknown parents: {self.unresolved_parents[:5]}")
+
+    def get_parent_id(self, name: str, parent_name: str) -> int:
+        parent_id = self.get_bone_id(parent_name)
+
+        if parent_id == NO_BONE and parent_name != "":
+            self.unresolved_parents.append((name, parent_name))
+
+        return parent_id
+
     def get_bone_id(self, parent_name: str) -> int:
-        for i in range(self.count_bones):
-            if self.bones[i].name == parent_name:
-                return i
+        return self.bone_ids.get(parent_name, NO_BONE)
+
+    def get_arrays(self) -> SkeletonArrays:
+        if self.arrays is None:
+            self.arrays = SkeletonArrays.from_bones(self.bones, self.bones_part)
+
+        return self.arrays
 
-        return 0
+    def get_world_transforms(self):
+        return self.get_arrays().get_world_transforms()
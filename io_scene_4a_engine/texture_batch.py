@@ -0,0 +1,79 @@
+import os
+import sys
+import time
+import argparse
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Tuple
+
+from .texture_tool import DDSUtils
+
+
+# Run from the repository root:
+#   python -m io_scene_4a_engine.texture_batch <content/textures> [--workers N] [--force]
+
+TEXTURE_EXTENSIONS = ('.512', '.1024', '.2048', '.4096', '.8192')
+
+
+def find_textures(root: str) -> List[str]:
+    textures = list()
+
+    for directory, _, files in os.walk(root):
+        for name in files:
+            if os.path.splitext(name)[1] in TEXTURE_EXTENSIONS:
+                textures.append(os.path.join(directory, name))
+
+    return textures
+
+
+def convert(metro_texture_path: str) -> Tuple[str, int, str]:
+    try:
+        DDSUtils.convert_texture(metro_texture_path)
+        return metro_texture_path, os.path.getsize(metro_texture_path), ""
+    except Exception as e:
+        return metro_texture_path, 0, str(e)
+
+
+def convert_directory(root: str, workers: int = None, force: bool = False) -> List[Tuple[str, str]]:
+    textures = find_textures(root)
+    pending = [path for path in textures if force or not DDSUtils.is_up_to_date(path, DDSUtils.get_dds_path(path))]
+
+    converted, total_size = 0, 0
+    failures = list()
+
+    start = time.perf_counter()
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for path, size, error in pool.map(convert, pending, chunksize=16):
+            if error:
+                failures.append((path, error))
+            else:
+                converted += 1
+                total_size += size
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+
+    print(f"found {len(textures)}, up to date {len(textures) - len(pending)}, "
+          f"converted {converted}, failed {len(failures)}")
+    print(f"{elapsed:.2f} s, {converted / elapsed:.1f} files/s, {total_size / elapsed / 1024 / 1024:.1f} MB/s")
+
+    for path, error in failures:
+        print(f"failed: {path}: {error}")
+
+    return failures
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Convert 4A textures of a directory tree into .dds files")
+    parser.add_argument('root', help="directory to search, e.g. content/textures of the game")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes, all CPUs by default")
+    parser.add_argument('--force', action='store_true', help="convert even if the .dds is up to date")
+
+    args = parser.parse_args(argv)
+    failures = convert_directory(args.root, args.workers, args.force)
+
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
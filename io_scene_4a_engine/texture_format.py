@@ -0,0 +1,60 @@
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, List, Optional
+
+
+DXT1 = "DXT1"
+DXT5 = "DXT5"
+
+BLOCK_SIZES = {DXT1: 8, DXT5: 16}  # bytes per 4x4 block
+TEXTURE_SIDES = [4 << i for i in range(12)]  # 4 .. 8192
+
+
+@dataclass(frozen=True)
+class TextureFormat:
+    four_cc: str
+    width: int
+    height: int
+    mip_map_count: int = 0  # 0 when the texture has no mip chain
+
+
+def get_mip_map_count(width: int, height: int) -> int:
+    # Full chain down to 1x1
+    return max(width, height).bit_length()
+
+
+def get_data_size(four_cc: str, width: int, height: int, mip_map_count: int = 0) -> int:
+    size = 0
+
+    for level in range(max(mip_map_count, 1)):
+        level_width, level_height = max(1, width >> level), max(1, height >> level)
+        size += ((level_width + 3) // 4) * ((level_height + 3) // 4) * BLOCK_SIZES[four_cc]
+
+    return size
+
+
+def build_format_index() -> Dict[int, List[TextureFormat]]:
+    index = dict()
+
+    for four_cc in (DXT1, DXT5):
+        for width in TEXTURE_SIDES:
+            for height in TEXTURE_SIDES:
+                for mip_map_count in (0, get_mip_map_count(width, height)):
+                    texture_format = TextureFormat(four_cc, width, height, mip_map_count)
+                    index.setdefault(get_data_size(four_cc, width, height, mip_map_count), []).append(texture_format)
+
+    return index
+
+
+FORMAT_INDEX = build_format_index()
+
+
+@lru_cache(maxsize=None)  # few distinct sizes per game, the candidate choice is made once for each
+def detect_format(texture_size: int, hw: int = 0) -> Optional[TextureFormat]:
+    candidates = FORMAT_INDEX.get(texture_size)
+
+    if not candidates:
+        return None
+
+    # Some sizes fit several layouts: prefer the side from the file extension, then square textures
+    return min(candidates, key=lambda f: (hw != 0 and max(f.width, f.height) != hw, f.width != f.height))
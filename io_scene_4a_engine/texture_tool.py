@@ -1,62 +1,152 @@
-from struct import pack
+import os
+import mmap
+
+from struct import pack, Struct
+from functools import lru_cache
 
 from dataclasses import dataclass, field
-from typing import List
+from typing import List, Dict, Tuple
+
+try:
+    from .texture_format import detect_format
+except ImportError:  # run as a plain script next to texture_format, like test.py
+    from texture_format import detect_format
+
+
+COPY_CHUNK_SIZE = 1024 * 1024
+
+DDS_SIGNATURE = 542327876  # 'DDS '
+DDS_PIXEL_FORMAT_LAYOUT = 'II4sIIIII'
+DDS_PIXEL_FORMAT = Struct('<' + DDS_PIXEL_FORMAT_LAYOUT)
+DDS_HEADER = Struct('<IIIIIiiI11i' + DDS_PIXEL_FORMAT_LAYOUT + 'IIIII')  # 128 bytes with the signature
 
 
 class DDSUtils:
     @staticmethod
     def convert_texture(metro_texture_path: str):
-        if metro_texture_path is "":
+        if metro_texture_path == "":
             raise Exception("Path cannot be empty")
 
-        with open(metro_texture_path, 'rb+') as image_bytes:
-            image_dds_data = image_bytes.read()
-            image_bytes.close()
-
-        dds_header = DDSHeader()
+        texture_size = os.path.getsize(metro_texture_path)
 
         hw = metro_texture_path.split('.')[-1]  # height, width of texture
         hw = int(hw)  # convert to int
 
+        dds_header = DDSUtils.get_header_bytes(hw, texture_size)
+        dds_result_path = DDSUtils.get_dds_path(metro_texture_path)
+
+        # Header first, then the texture data is streamed behind it without loading it whole
+        with open(metro_texture_path, 'rb') as image_bytes, open(dds_result_path, 'wb') as dds_image:
+            dds_image.write(dds_header)
+            DDSUtils.copy_data(image_bytes, dds_image, texture_size)
+
+        return dds_result_path
+
+    @staticmethod
+    def wrap_texture(metro_texture_path: str):
+        if metro_texture_path == "":
+            raise Exception("Path cannot be empty")
+
+        with open(metro_texture_path, 'rb') as image_bytes:
+            try:
+                data = memoryview(mmap.mmap(image_bytes.fileno(), 0, access=mmap.ACCESS_READ))
+            except ValueError:  # empty files cannot be mapped
+                data = memoryview(b'')
+
+        hw = int(metro_texture_path.split('.')[-1])  # height, width of texture
+        return DDSTexture(DDSUtils.get_header_bytes(hw, len(data)), data)
+
+    @staticmethod
+    def get_header_bytes(hw: int, texture_size: int) -> bytes:
+        texture_format = detect_format(texture_size, hw)
+
+        if texture_format is None:
+            raise Exception(f"Unknown texture format: {texture_size} bytes for size {hw}")
+
+        return DDSUtils.get_header_template(texture_format.width,
+                                            texture_format.height,
+                                            texture_format.four_cc,
+                                            texture_format.mip_map_count)
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def get_header_template(width: int, height: int, four_cc: str, mip_map_count: int) -> bytes:
+        # Headers only differ by these four values, so each combination is packed once
+        return DDSUtils.make_header(width, height, four_cc, mip_map_count).get_bytes()
+
+    @staticmethod
+    def make_header(width: int, height: int, four_cc: str, mip_map_count: int):
+        dds_header = DDSHeader()
+
         dds_header.flags = 0x1 | 0x2 | 0x4 | 0x1000
         dds_header.caps = 0x1000
 
-        if hw == 512:  # contains mip map
-            dds_header.mip_map_count = 10
+        if mip_map_count > 0:  # contains mip map
+            dds_header.mip_map_count = mip_map_count
             dds_header.flags = dds_header.flags | 0x20000
             dds_header.caps = dds_header.caps | 0x400000
 
-        dds_header.height = hw
-        dds_header.width = hw
+        dds_header.height = height
+        dds_header.width = width
 
-        is_dxt5 = True
+        dds_header.dds_pixels.four_cc = DDSPixelFormat.make_four_cc(four_cc=four_cc)
 
-        if hw == 512 and len(image_dds_data) == 174776:
-            is_dxt5 = False
-        elif hw == 1024 and len(image_dds_data) == 524288:
-            is_dxt5 = False
-        elif hw == 2048 and len(image_dds_data) == 2097152:
-            is_dxt5 = False
-        elif hw == 4096 and len(image_dds_data) == 16777216:
-            is_dxt5 = False
-        elif hw == 8192 and len(image_dds_data) == 268435456:
-            is_dxt5 = False
+        return dds_header
 
-        if is_dxt5:
-            dds_header.dds_pixels.four_cc = DDSPixelFormat.make_four_cc(four_cc="DXT5")
-        else:
-            dds_header.dds_pixels.four_cc = DDSPixelFormat.make_four_cc(four_cc="DXT1")
+    @staticmethod
+    def copy_data(source, target, size: int):
+        target.flush()
+
+        source_start, target_start = source.tell(), target.tell()
+        copied = 0
+
+        # Let the kernel move the data where it can, copy_file_range first, then sendfile
+        try:
+            if hasattr(os, 'copy_file_range'):
+                while copied < size:
+                    sent = os.copy_file_range(source.fileno(), target.fileno(), size - copied,
+                                              source_start + copied, target_start + copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+            elif hasattr(os, 'sendfile'):
+                target.seek(target_start)
+
+                while copied < size:
+                    sent = os.sendfile(target.fileno(), source.fileno(), source_start + copied, size - copied)
+                    if sent == 0:
+                        break
+                    copied += sent
+        except OSError:  # not supported for these files, e.g. sendfile into a regular file on macOS
+            pass
+
+        source.seek(source_start + copied)
+        target.seek(target_start + copied)
+
+        while copied < size:
+            data = source.read(min(COPY_CHUNK_SIZE, size - copied))
+            if not data:
+                break
+
+            target.write(data)
+            copied += len(data)
+
+        return copied
 
-        dds_result = dds_header.get_bytes() + image_dds_data
+    @staticmethod
+    def get_dds_path(metro_texture_path: str) -> str:
+        # The size extension stays in the name, every resolution of a texture gets its own .dds
+        return metro_texture_path + '.dds'
 
-        dds_result_path = metro_texture_path.replace(f'.{hw}', '.dds')
+    @staticmethod
+    def is_up_to_date(metro_texture_path: str, dds_path: str) -> bool:
+        if not os.path.exists(dds_path):
+            return False
 
-        with open(dds_result_path, 'wb+') as dds_image:
-            dds_image.write(dds_result)
-            dds_image.close()
+        source, result = os.stat(metro_texture_path), os.stat(dds_path)
 
-        return dds_result_path
+        # A converted texture is the 128 byte header followed by the untouched source data
+        return result.st_mtime_ns >= source.st_mtime_ns and result.st_size == source.st_size + 128
 
     @staticmethod
     def pack_i32(num: int) -> bytes:
@@ -85,6 +175,59 @@ class DDSUtils:
         return res
 
 
+@dataclass
+class DDSTexture:
+    header: bytes
+    data: memoryview  # read-only view of the source texture, nothing is copied
+
+    def __len__(self):
+        return len(self.header) + len(self.data)
+
+    def get_bytes(self) -> bytes:
+        return b''.join((self.header, self.data))
+
+    def write(self, dds_image):
+        dds_image.write(self.header)
+        dds_image.write(self.data)
+
+
+class TextureCache:
+    converted: Dict[Tuple[str, int, int], str]
+    images: dict
+    hits: int
+    misses: int
+
+    def __init__(self):
+        self.converted = dict()
+        self.images = dict()  # Blender images by (texture path, packed), shared by all models of an import
+        self.hits = 0
+        self.misses = 0
+
+    def convert_texture(self, metro_texture_path: str) -> str:
+        stat = os.stat(metro_texture_path)
+        key = (os.path.abspath(metro_texture_path), stat.st_mtime_ns, stat.st_size)
+
+        dds_path = self.converted.get(key)
+
+        if dds_path is None:
+            dds_path = DDSUtils.get_dds_path(metro_texture_path)
+
+            if DDSUtils.is_up_to_date(metro_texture_path, dds_path):
+                self.hits += 1
+            else:
+                dds_path = DDSUtils.convert_texture(metro_texture_path)
+                self.misses += 1
+
+            self.converted[key] = dds_path
+        else:
+            self.hits += 1
+
+        return dds_path
+
+    def stats(self) -> str:
+        return f"textures: {len(self.converted)} unique, {self.hits} cache hits, {self.misses} converted"
+
+
 @dataclass
 class DDSPixelFormat:
     size: int = 32
@@ -96,19 +239,12 @@ class DDSPixelFormat:
     blue_bit_mask: int = 0
     alpha_bit_mask: int = 0
 
-    def get_bytes(self) -> bytes:
-        result = bytes()
-
-        result += DDSUtils.pack_u32(self.size)  # convert size block
-        result += DDSUtils.pack_u32(self.flags)  # convert flags pixels
-        result += self.four_cc  # add four cc dds
-        result += DDSUtils.pack_u32(self.rgb_bit_count)  # convert rgb mask
-        result += DDSUtils.pack_u32(self.red_bit_mask)  # convert red mask
-        result += DDSUtils.pack_u32(self.green_bit_mask)  # convert green mask
-        result += DDSUtils.pack_u32(self.blue_bit_mask)  # convert blue mask
-        result += DDSUtils.pack_u32(self.alpha_bit_mask)  # convert alpha mask
+    def get_values(self) -> tuple:
+        return (self.size, self.flags, self.four_cc, self.rgb_bit_count,
+                self.red_bit_mask, self.green_bit_mask, self.blue_bit_mask, self.alpha_bit_mask)
 
-        return result
+    def get_bytes(self) -> bytes:
+        return DDS_PIXEL_FORMAT.pack(*self.get_values())
 
     @staticmethod
     def make_four_cc(four_cc: str) -> bytes:
@@ -133,27 +269,15 @@ class DDSHeader:
     reserved2: int = 0
 
     def get_bytes(self) -> bytes:
-        result = bytes()
-
         if len(self.reserved) != 11:
             self.reserved = [0, 0, 0, 0,
                              0, 0, 0, 0,
                              0, 0, 0]
 
-        result += DDSUtils.pack_u32(542327876)  # add signature of dds
-        result += DDSUtils.pack_u32(self.size)  # to byte array size
-        result += DDSUtils.pack_u32(self.flags)  # convert flags
-        result += DDSUtils.pack_u32(self.height)  # convert height
-        result += DDSUtils.pack_u32(self.width)  # convert width
-        result += DDSUtils.pack_i32(self.linear_size)  # convert pitch ot linear size
-        result += DDSUtils.pack_i32(self.depth)  # convert depth texture
-        result += DDSUtils.pack_u32(self.mip_map_count)  # convert count of pixels (mip) maps
-        result += DDSUtils.pack_list_i32(self.reserved)  # convert reserved
-        result += self.dds_pixels.get_bytes()  # get bytes of pixels
-        result += DDSUtils.pack_u32(self.caps)  # convert caps one of dds
-        result += DDSUtils.pack_u32(self.caps2)  # convert caps two of dds
-        result += DDSUtils.pack_u32(self.caps3)  # convert caps three of dds
-        result += DDSUtils.pack_u32(self.caps4)  # convert caps four of dds
-        result += DDSUtils.pack_u32(self.reserved2)  # convert reserved two of dds
-
-        return result
+        return DDS_HEADER.pack(DDS_SIGNATURE,
+                               self.size, self.flags, self.height, self.width,
+                               self.linear_size, self.depth, self.mip_map_count,
+                               *self.reserved,
+                               *self.dds_pixels.get_values(),
+                               self.caps, self.caps2, self.caps3, self.caps4,
+                               self.reserved2)